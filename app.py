@@ -4,14 +4,34 @@ Flask backend with SQLite database
 """
 
 import os
-import json
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify, session
+from datetime import datetime, timedelta
+from functools import cached_property, lru_cache, wraps
+from operator import itemgetter
+import orjson
+from flask import Flask, Response, g, render_template, request, jsonify, session, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from flask_caching import Cache
+from flask_session import Session
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import selectinload
+from sqlalchemy import event, func, inspect, select, text, union_all
 from werkzeug.security import generate_password_hash, check_password_hash
 
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson for faster request/response handling"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 # Initialize Flask app
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 # Database configuration
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -19,7 +39,22 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'sp
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'splittrip-secret-key-change-in-production'
 
+# Server-side sessions keep authorized trips out of the signed cookie
+app.config['SESSION_TYPE'] = 'filesystem'
+app.config['SESSION_FILE_DIR'] = os.path.join(basedir, 'flask_session')
+app.config['SESSION_PERMANENT'] = False
+# The filesystem backend prunes its oldest files past the threshold, so size it
+# well above the expected number of concurrent sessions
+app.config['SESSION_FILE_THRESHOLD'] = 10000
+app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
+
+# Per-process cache for serialized GET responses
+app.config['CACHE_TYPE'] = 'SimpleCache'
+app.config['CACHE_DEFAULT_TIMEOUT'] = 60
+
 db = SQLAlchemy(app)
+Session(app)
+cache = Cache(app)
 
 # ===================================
 # Database Models
@@ -37,7 +72,44 @@ class Trip(db.Model):
     expenses = db.relationship('Expense', backref='trip', lazy=True, cascade='all, delete-orphan')
     participants = db.relationship('Participant', backref='trip', lazy=True, cascade='all, delete-orphan')
     
-    def to_dict(self, include_members=False, current_phone=None):
+    @hybrid_property
+    def expense_count(self):
+        return (
+            db.session.query(func.count(Expense.id))
+            .filter(Expense.trip_id == self.id)
+            .scalar()
+        )
+    
+    @expense_count.expression
+    def expense_count(cls):
+        return (
+            select(func.count(Expense.id))
+            .where(Expense.trip_id == cls.id)
+            .scalar_subquery()
+        )
+    
+    @hybrid_property
+    def total_amount(self):
+        return (
+            db.session.query(func.coalesce(func.sum(Expense.amount), 0))
+            .filter(Expense.trip_id == self.id)
+            .scalar()
+        )
+    
+    @total_amount.expression
+    def total_amount(cls):
+        return (
+            select(func.coalesce(func.sum(Expense.amount), 0))
+            .where(Expense.trip_id == cls.id)
+            .scalar_subquery()
+        )
+    
+    def to_dict(self, include_members=False, current_phone=None, expense_count=None, total_amount=None):
+        """Serialize the trip; pass precomputed expense stats to skip loading expenses"""
+        if expense_count is None:
+            expense_count = self.expense_count
+        if total_amount is None:
+            total_amount = self.total_amount
         members_data = []
         if include_members:
             members_data = [
@@ -57,8 +129,8 @@ class Trip(db.Model):
             'currency': self.currency,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
-            'expense_count': len(self.expenses),
-            'total_amount': sum(e.amount for e in self.expenses),
+            'expense_count': expense_count,
+            'total_amount': total_amount,
             'members': members_data,
             'current_user_is_admin': is_admin
         }
@@ -73,6 +145,11 @@ class Participant(db.Model):
     is_admin = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_participant_trip_phone', 'trip_id', 'phone'),
+        db.Index('ix_participant_phone', 'phone'),
+    )
+
 
 class Expense(db.Model):
     """Expense model - stores individual expenses"""
@@ -82,8 +159,31 @@ class Expense(db.Model):
     amount = db.Column(db.Float, nullable=False)
     category = db.Column(db.String(30), nullable=False, default='Miscellaneous')
     paid_by = db.Column(db.String(100), nullable=False)
-    split_between = db.Column(db.Text, nullable=False)  # JSON array of member names
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Members sharing this expense, in the order they were submitted
+    splits = db.relationship(
+        'ExpenseSplit', backref='expense', lazy='selectin',
+        cascade='all, delete-orphan', order_by='ExpenseSplit.id'
+    )
+
+    __table_args__ = (
+        db.Index('ix_expense_trip_created', 'trip_id', 'created_at'),
+    )
+    
+    # created_at never changes after insert, so format it once per instance
+    @cached_property
+    def created_at_iso(self):
+        return self.created_at.isoformat()
+    
+    @cached_property
+    def timestamp_ms(self):
+        return int(self.created_at.timestamp() * 1000)
+    
+    @cached_property
+    def split_list(self):
+        """Member names sharing this expense, built once per instance"""
+        return [s.member_name for s in self.splits]
     
     def to_dict(self):
         return {
@@ -93,21 +193,282 @@ class Expense(db.Model):
             'amount': self.amount,
             'category': self.category,
             'paid_by': self.paid_by,
-            'split_between': json.loads(self.split_between),
-            'created_at': self.created_at.isoformat(),
-            'timestamp': int(self.created_at.timestamp() * 1000)
+            'split_between': self.split_list,
+            'created_at': self.created_at_iso,
+            'timestamp': self.timestamp_ms
         }
 
 
+class ExpenseSplit(db.Model):
+    """ExpenseSplit model - one row per member sharing an expense"""
+    id = db.Column(db.Integer, primary_key=True)
+    expense_id = db.Column(db.Integer, db.ForeignKey('expense.id'), nullable=False)
+    member_name = db.Column(db.String(100), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_expense_split_expense', 'expense_id'),
+    )
+
+
 EXPENSE_CATEGORIES = {'Travel', 'Food', 'Activity', 'Miscellaneous'}
 
+# PINs are short, so a heavy KDF mostly adds request latency; existing hashes
+# keep verifying because check_password_hash reads the method from the hash
+PIN_HASH_METHOD = 'pbkdf2:sha256:50000'
+
 
 # ===================================
 # Create database tables
 # ===================================
 
+def migrate_split_between():
+    """Move legacy JSON split_between values into ExpenseSplit rows"""
+    columns = {c['name'] for c in inspect(db.engine).get_columns('expense')}
+    if 'split_between' not in columns:
+        return
+    rows = db.session.execute(text('SELECT id, split_between FROM expense')).all()
+    splits = [
+        {'expense_id': expense_id, 'member_name': name}
+        for expense_id, split_between in rows
+        for name in orjson.loads(split_between)
+    ]
+    if splits:
+        db.session.execute(ExpenseSplit.__table__.insert(), splits)
+    db.session.execute(text('ALTER TABLE expense DROP COLUMN split_between'))
+    db.session.commit()
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL journaling so commits don't fsync on every write or block readers"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
+
 with app.app_context():
+    event.listen(db.engine, 'connect', set_sqlite_pragmas)
     db.create_all()
+    # create_all skips tables that already exist, so add any missing indexes
+    for model in (Participant, Expense):
+        for index in model.__table__.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    migrate_split_between()
+
+
+# ===================================
+# Helpers
+# ===================================
+
+def trips_for_phone(phone):
+    """List trips that include a phone, with expense stats aggregated in SQL"""
+    stats = (
+        db.session.query(
+            Expense.trip_id,
+            func.count(Expense.id).label('expense_count'),
+            func.sum(Expense.amount).label('total_amount')
+        )
+        .group_by(Expense.trip_id)
+        .subquery()
+    )
+    rows = (
+        Trip.query.join(Participant)
+        .outerjoin(stats, Trip.id == stats.c.trip_id)
+        .add_columns(stats.c.expense_count, stats.c.total_amount)
+        .filter(Participant.phone == phone)
+        .order_by(Trip.updated_at.desc())
+        .all()
+    )
+    return [
+        trip.to_dict(expense_count=count or 0, total_amount=total or 0)
+        for trip, count, total in rows
+    ]
+
+
+def expense_version(trip):
+    """Cache key component that changes whenever a trip's expenses change"""
+    count, last_id = (
+        db.session.query(func.count(Expense.id), func.coalesce(func.max(Expense.id), 0))
+        .filter(Expense.trip_id == trip.id)
+        .one()
+    )
+    return (trip.updated_at, count, last_id)
+
+
+def balance_key(trip):
+    """Arguments shared by the balance and settlement calculations"""
+    members = tuple(p.name for p in trip.participants)
+    # Reuse the version cached_trip_response already looked up for this request
+    version = g.get('expense_version') or expense_version(trip)
+    return trip.id, members, version
+
+
+def trip_detail(trip_id, current_phone):
+    """Trip with members and expenses, eager loaded in a fixed number of queries"""
+    trip = (
+        Trip.query.options(
+            selectinload(Trip.participants).load_only(
+                Participant.name, Participant.phone, Participant.is_admin
+            ),
+            selectinload(Trip.expenses)
+        )
+        .filter_by(id=trip_id)
+        .populate_existing()
+        .first_or_404()
+    )
+    expenses = trip.expenses
+    trip_data = trip.to_dict(
+        include_members=True,
+        current_phone=current_phone,
+        expense_count=len(expenses),
+        total_amount=sum(e.amount for e in expenses)
+    )
+    trip_data['expenses'] = [e.to_dict() for e in expenses]
+    return trip_data
+
+
+# Results are keyed by expense_version, so stale entries are simply never hit
+# again. Cached values are shared between requests and must not be mutated.
+
+@lru_cache(maxsize=512)
+def _compute_balances(trip_id, members, version):
+    """Net balance per member: amount paid minus share owed (unrounded)"""
+    balances = {member: 0.0 for member in members}
+    
+    split_counts = (
+        select(ExpenseSplit.expense_id, func.count().label('split_count'))
+        .join(Expense, Expense.id == ExpenseSplit.expense_id)
+        .where(Expense.trip_id == trip_id)
+        .group_by(ExpenseSplit.expense_id)
+        .subquery()
+    )
+    # Person who paid gets credit
+    credits = (
+        select(Expense.paid_by.label('name'), Expense.amount.label('delta'))
+        .where(Expense.trip_id == trip_id)
+    )
+    # Each person in the split owes their share
+    debits = (
+        select(
+            ExpenseSplit.member_name.label('name'),
+            (-Expense.amount / split_counts.c.split_count).label('delta')
+        )
+        .join(Expense, Expense.id == ExpenseSplit.expense_id)
+        .join(split_counts, split_counts.c.expense_id == ExpenseSplit.expense_id)
+    )
+    deltas = union_all(credits, debits).subquery()
+    # Names that are no longer members are dropped in SQL, so every row maps
+    # straight onto a member slot
+    net = db.session.execute(
+        select(deltas.c.name, func.sum(deltas.c.delta))
+        .where(deltas.c.name.in_(members))
+        .group_by(deltas.c.name)
+    )
+    balances.update(net.all())
+    
+    return balances
+
+
+@lru_cache(maxsize=512)
+def _compute_settlements(trip_id, members, version):
+    """Greedy settlement plan that minimizes the number of transactions"""
+    balances = _compute_balances(trip_id, members, version)
+    
+    # Separate into debtors and creditors, sorted by amount (largest first)
+    debtors = sorted(
+        ((name, -balance) for name, balance in balances.items() if balance < -0.01),
+        key=itemgetter(1), reverse=True
+    )
+    creditors = sorted(
+        ((name, balance) for name, balance in balances.items() if balance > 0.01),
+        key=itemgetter(1), reverse=True
+    )
+    
+    # Keep the remaining amounts as plain float lists for the greedy pass
+    debts = [amount for _, amount in debtors]
+    credits = [amount for _, amount in creditors]
+    
+    # Calculate settlements
+    settlements = []
+    i, j = 0, 0
+    
+    while i < len(debts) and j < len(credits):
+        amount = min(debts[i], credits[j])
+        
+        if amount > 0.01:
+            settlements.append({
+                'from': debtors[i][0],
+                'to': creditors[j][0],
+                'amount': round(amount, 2)
+            })
+        
+        debts[i] -= amount
+        credits[j] -= amount
+        
+        if debts[i] < 0.01:
+            i += 1
+        if credits[j] < 0.01:
+            j += 1
+    
+    return settlements
+
+
+def sign_in(phone, trip_id=None):
+    """Remember the session's phone and, optionally, a trip it has unlocked"""
+    authorized = session.get('authorized_trips', set())
+    if session.get('phone') == phone and (trip_id is None or trip_id in authorized):
+        # Nothing new to record, so leave the session unmodified
+        return
+    # Access is widening: move to a fresh session id so an id planted before
+    # sign-in (server-side ids are not signed) never gains this access
+    interface = app.session_interface
+    interface.cache.delete(interface.key_prefix + session.sid)
+    session.sid = interface._generate_sid()
+    session['phone'] = phone
+    if trip_id is not None:
+        session['authorized_trips'] = authorized | {trip_id}
+
+
+def require_trip(admin=False):
+    """Require an unlocked trip (and its admin if admin=True); loads it into g.trip"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(trip_id, *args, **kwargs):
+            if trip_id not in session.get('authorized_trips', ()):
+                return jsonify({'error': 'Access denied'}), 403
+            g.trip = Trip.query.get_or_404(trip_id)
+            if admin:
+                participant = Participant.query.filter_by(
+                    trip_id=trip_id, phone=session.get('phone')
+                ).first()
+                if not participant or not participant.is_admin:
+                    return jsonify({'error': 'Admin access required'}), 403
+                g.participant = participant
+            return view(trip_id, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def cached_trip_response(view):
+    """Cache a trip GET response body until the trip or its expenses change"""
+    @wraps(view)
+    def wrapper(trip_id, *args, **kwargs):
+        g.expense_version = expense_version(g.trip)
+        # Phone is part of the key because responses can be user specific
+        key = 'trip:{}:{}:{}:{}'.format(
+            trip_id, view.__name__, session.get('phone'), g.expense_version
+        )
+        body = cache.get(key)
+        if body is None:
+            response = view(trip_id, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            cache.set(key, body)
+        return Response(body, mimetype='application/json')
+    return wrapper
 
 
 # ===================================
@@ -131,13 +492,7 @@ def get_trips():
     if not phone:
         return jsonify({'error': 'Login required'}), 401
     
-    trips = (
-        Trip.query.join(Participant)
-        .filter(Participant.phone == phone)
-        .order_by(Trip.updated_at.desc())
-        .all()
-    )
-    return jsonify([trip.to_dict() for trip in trips])
+    return jsonify(trips_for_phone(phone))
 
 
 @app.route('/api/login', methods=['POST'])
@@ -148,14 +503,8 @@ def login():
     if not phone:
         return jsonify({'error': 'Phone is required'}), 400
     
-    session['phone'] = phone
-    trips = (
-        Trip.query.join(Participant)
-        .filter(Participant.phone == phone)
-        .order_by(Trip.updated_at.desc())
-        .all()
-    )
-    return jsonify([trip.to_dict() for trip in trips])
+    sign_in(phone)
+    return jsonify(trips_for_phone(phone))
 
 
 @app.route('/api/logout', methods=['POST'])
@@ -199,7 +548,7 @@ def create_trip():
         participants_payload.append({
             'name': name,
             'phone': phone,
-            'pin_hash': generate_password_hash(pin),
+            'pin_hash': generate_password_hash(pin, method=PIN_HASH_METHOD),
             'is_admin': phone == admin_phone
         })
 
@@ -213,20 +562,14 @@ def create_trip():
     db.session.add(trip)
     db.session.flush()
 
-    for member in participants_payload:
-        participant = Participant(
-            trip_id=trip.id,
-            name=member['name'],
-            phone=member['phone'],
-            pin_hash=member['pin_hash'],
-            is_admin=member['is_admin']
-        )
-        db.session.add(participant)
+    db.session.execute(
+        Participant.__table__.insert(),
+        [dict(member, trip_id=trip.id) for member in participants_payload]
+    )
 
     db.session.commit()
 
-    session['phone'] = admin_phone
-    session['authorized_trips'] = list(set(session.get('authorized_trips', []) + [trip.id]))
+    sign_in(admin_phone, trip.id)
 
     return jsonify(trip.to_dict(include_members=True, current_phone=admin_phone)), 201
 
@@ -244,37 +587,26 @@ def verify_trip_access(trip_id):
     if not participant or not check_password_hash(participant.pin_hash, pin):
         return jsonify({'error': 'Invalid phone or PIN'}), 403
     
-    session['phone'] = phone
-    session['authorized_trips'] = list(set(session.get('authorized_trips', []) + [trip_id]))
+    sign_in(phone, trip_id)
 
-    trip = Trip.query.get_or_404(trip_id)
-    trip_data = trip.to_dict(include_members=True, current_phone=phone)
-    trip_data['expenses'] = [e.to_dict() for e in trip.expenses]
-    return jsonify(trip_data)
+    return jsonify(trip_detail(trip_id, phone))
 
 
 @app.route('/api/trips/<int:trip_id>', methods=['GET'])
+@require_trip()
+@cached_trip_response
 def get_trip(trip_id):
     """Get a specific trip with all expenses"""
-    if trip_id not in session.get('authorized_trips', []):
-        return jsonify({'error': 'Access denied'}), 403
-    trip = Trip.query.get_or_404(trip_id)
-    trip_data = trip.to_dict(include_members=True, current_phone=session.get('phone'))
-    trip_data['expenses'] = [e.to_dict() for e in trip.expenses]
-    return jsonify(trip_data)
+    return jsonify(trip_detail(trip_id, session.get('phone')))
 
 
 @app.route('/api/trips/<int:trip_id>', methods=['PUT'])
+@require_trip(admin=True)
 def update_trip(trip_id):
     """Update trip details"""
-    if trip_id not in session.get('authorized_trips', []):
-        return jsonify({'error': 'Access denied'}), 403
-    trip = Trip.query.get_or_404(trip_id)
+    trip = g.trip
     data = request.get_json()
     current_phone = session.get('phone')
-    participant = Participant.query.filter_by(trip_id=trip_id, phone=current_phone).first()
-    if not participant or not participant.is_admin:
-        return jsonify({'error': 'Admin access required'}), 403
     
     if data.get('name'):
         trip.name = data['name']
@@ -312,47 +644,50 @@ def update_trip(trip_id):
                     'warning': 'Changing members will require clearing expenses',
                     'needs_confirmation': True
                 }), 409
+            trip_expense_ids = select(Expense.id).where(Expense.trip_id == trip_id)
+            ExpenseSplit.query.filter(
+                ExpenseSplit.expense_id.in_(trip_expense_ids)
+            ).delete(synchronize_session=False)
             Expense.query.filter_by(trip_id=trip_id).delete()
 
         existing_participants = {p.phone: p for p in trip.participants}
         Participant.query.filter_by(trip_id=trip_id).delete()
         db.session.flush()
 
+        participant_rows = []
         for member in members:
             name = (member.get('name') or '').strip()
             phone = (member.get('phone') or '').strip()
             pin = (member.get('pin') or '').strip()
             if pin:
-                pin_hash = generate_password_hash(pin)
+                pin_hash = generate_password_hash(pin, method=PIN_HASH_METHOD)
             else:
                 existing = existing_participants.get(phone)
                 if not existing:
                     return jsonify({'error': 'PIN is required for new participants'}), 400
                 pin_hash = existing.pin_hash
 
-            db.session.add(Participant(
-                trip_id=trip_id,
-                name=name,
-                phone=phone,
-                pin_hash=pin_hash,
-                is_admin=(phone == admin_phone)
-            ))
+            participant_rows.append({
+                'trip_id': trip_id,
+                'name': name,
+                'phone': phone,
+                'pin_hash': pin_hash,
+                'is_admin': phone == admin_phone
+            })
+
+        db.session.execute(Participant.__table__.insert(), participant_rows)
     
+    # Members are not part of the trip row, so bump it explicitly for caches
+    trip.updated_at = datetime.utcnow()
     db.session.commit()
     return jsonify(trip.to_dict(include_members=True, current_phone=current_phone))
 
 
 @app.route('/api/trips/<int:trip_id>', methods=['DELETE'])
+@require_trip(admin=True)
 def delete_trip(trip_id):
     """Delete a trip and all its expenses"""
-    if trip_id not in session.get('authorized_trips', []):
-        return jsonify({'error': 'Access denied'}), 403
-    current_phone = session.get('phone')
-    participant = Participant.query.filter_by(trip_id=trip_id, phone=current_phone).first()
-    if not participant or not participant.is_admin:
-        return jsonify({'error': 'Admin access required'}), 403
-    trip = Trip.query.get_or_404(trip_id)
-    db.session.delete(trip)
+    db.session.delete(g.trip)
     db.session.commit()
     return jsonify({'message': 'Trip deleted'})
 
@@ -362,21 +697,32 @@ def delete_trip(trip_id):
 # ===================================
 
 @app.route('/api/trips/<int:trip_id>/expenses', methods=['GET'])
+@require_trip()
 def get_expenses(trip_id):
     """Get all expenses for a trip"""
-    if trip_id not in session.get('authorized_trips', []):
-        return jsonify({'error': 'Access denied'}), 403
-    trip = Trip.query.get_or_404(trip_id)
-    expenses = Expense.query.filter_by(trip_id=trip_id).order_by(Expense.created_at.desc()).all()
-    return jsonify([e.to_dict() for e in expenses])
+    def generate():
+        # Serialize row by row instead of building the whole list first
+        expenses = db.session.execute(
+            select(Expense)
+            .filter_by(trip_id=trip_id)
+            .order_by(Expense.created_at.desc())
+            .execution_options(yield_per=200)
+        ).scalars()
+        yield b'['
+        for i, expense in enumerate(expenses):
+            if i:
+                yield b','
+            yield orjson.dumps(expense.to_dict())
+        yield b']'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 
 @app.route('/api/trips/<int:trip_id>/expenses', methods=['POST'])
+@require_trip()
 def create_expense(trip_id):
     """Add a new expense to a trip"""
-    if trip_id not in session.get('authorized_trips', []):
-        return jsonify({'error': 'Access denied'}), 403
-    trip = Trip.query.get_or_404(trip_id)
+    trip = g.trip
     data = request.get_json()
     
     if not data.get('description'):
@@ -396,27 +742,40 @@ def create_expense(trip_id):
     if not split_between:
         return jsonify({'error': 'At least one person to split with is required'}), 400
     
-    expense = Expense(
-        trip_id=trip_id,
-        description=data['description'],
-        amount=float(data['amount']),
-        category=category,
-        paid_by=data['paid_by'],
-        split_between=json.dumps(split_between)
+    # Core inserts skip the ORM unit of work; the body is built from the payload
+    created_at = datetime.utcnow()
+    expense = {
+        'trip_id': trip_id,
+        'description': data['description'],
+        'amount': float(data['amount']),
+        'category': category,
+        'paid_by': data['paid_by'],
+        'created_at': created_at
+    }
+    result = db.session.execute(Expense.__table__.insert(), expense)
+    expense_id = result.inserted_primary_key[0]
+    db.session.execute(
+        ExpenseSplit.__table__.insert(),
+        [{'expense_id': expense_id, 'member_name': name} for name in split_between]
     )
-    
-    db.session.add(expense)
+    trip.updated_at = created_at
     db.session.commit()
     
-    return jsonify(expense.to_dict()), 201
+    expense.update({
+        'id': expense_id,
+        'split_between': split_between,
+        'created_at': created_at.isoformat(),
+        'timestamp': int(created_at.timestamp() * 1000)
+    })
+    return jsonify(expense), 201
 
 
 @app.route('/api/trips/<int:trip_id>/expenses/<int:expense_id>', methods=['DELETE'])
+@require_trip()
 def delete_expense(trip_id, expense_id):
     """Delete an expense"""
-    if trip_id not in session.get('authorized_trips', []):
-        return jsonify({'error': 'Access denied'}), 403
     expense = Expense.query.filter_by(id=expense_id, trip_id=trip_id).first_or_404()
+    g.trip.updated_at = datetime.utcnow()
     db.session.delete(expense)
     db.session.commit()
     return jsonify({'message': 'Expense deleted'})
@@ -427,30 +786,12 @@ def delete_expense(trip_id, expense_id):
 # ===================================
 
 @app.route('/api/trips/<int:trip_id>/balances', methods=['GET'])
+@require_trip()
+@cached_trip_response
 def get_balances(trip_id):
     """Calculate and return balances for all members"""
-    if trip_id not in session.get('authorized_trips', []):
-        return jsonify({'error': 'Access denied'}), 403
-    trip = Trip.query.get_or_404(trip_id)
-    members = [p.name for p in trip.participants]
-    expenses = trip.expenses
-    
-    # Initialize balances
-    balances = {member: 0.0 for member in members}
-    
-    # Calculate balances
-    for expense in expenses:
-        split_between = json.loads(expense.split_between)
-        split_amount = expense.amount / len(split_between)
-        
-        # Person who paid gets credit
-        if expense.paid_by in balances:
-            balances[expense.paid_by] += expense.amount
-        
-        # Each person in the split owes their share
-        for person in split_between:
-            if person in balances:
-                balances[person] -= split_amount
+    trip = g.trip
+    balances = _compute_balances(*balance_key(trip))
     
     # Round to 2 decimal places
     balances = {k: round(v, 2) for k, v in balances.items()}
@@ -459,66 +800,12 @@ def get_balances(trip_id):
 
 
 @app.route('/api/trips/<int:trip_id>/settlements', methods=['GET'])
+@require_trip()
+@cached_trip_response
 def get_settlements(trip_id):
     """Calculate optimal settlements to minimize transactions"""
-    if trip_id not in session.get('authorized_trips', []):
-        return jsonify({'error': 'Access denied'}), 403
-    trip = Trip.query.get_or_404(trip_id)
-    members = [p.name for p in trip.participants]
-    expenses = trip.expenses
-    
-    # Calculate balances first
-    balances = {member: 0.0 for member in members}
-    
-    for expense in expenses:
-        split_between = json.loads(expense.split_between)
-        split_amount = expense.amount / len(split_between)
-        
-        if expense.paid_by in balances:
-            balances[expense.paid_by] += expense.amount
-        
-        for person in split_between:
-            if person in balances:
-                balances[person] -= split_amount
-    
-    # Separate into debtors and creditors
-    debtors = []
-    creditors = []
-    
-    for name, balance in balances.items():
-        if balance < -0.01:
-            debtors.append({'name': name, 'amount': abs(balance)})
-        elif balance > 0.01:
-            creditors.append({'name': name, 'amount': balance})
-    
-    # Sort by amount (largest first)
-    debtors.sort(key=lambda x: x['amount'], reverse=True)
-    creditors.sort(key=lambda x: x['amount'], reverse=True)
-    
-    # Calculate settlements
-    settlements = []
-    i, j = 0, 0
-    
-    while i < len(debtors) and j < len(creditors):
-        debtor = debtors[i]
-        creditor = creditors[j]
-        amount = min(debtor['amount'], creditor['amount'])
-        
-        if amount > 0.01:
-            settlements.append({
-                'from': debtor['name'],
-                'to': creditor['name'],
-                'amount': round(amount, 2)
-            })
-        
-        debtor['amount'] -= amount
-        creditor['amount'] -= amount
-        
-        if debtor['amount'] < 0.01:
-            i += 1
-        if creditor['amount'] < 0.01:
-            j += 1
-    
+    trip = g.trip
+    settlements = _compute_settlements(*balance_key(trip))
     return jsonify(settlements)
 
 